@@ -31,12 +31,14 @@
 
 import json
 import logging
+import mmap
 import os
 import plistlib
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+from helpers.utils import http_session
 
 ###########################
 ######### LOGGING #########
@@ -44,6 +46,29 @@ import requests
 
 log = logging.getLogger(__name__)
 
+# non-capture group matches on optional 64 char hex string
+# capture matches one or more word and/or whitespace chars (non-greedy)
+# non-capture positive lookahead assertion to indicate match will be found before version or dashes
+_NAME_ONLY_RE = re.compile(r"(?:[a-f0-9]{64}--)?([\w\s]+?)(?=\s+\d+\.\d+|[.-])")
+
+# Enforcement names translated between config values and API-valid values (both directions)
+_ENFORCEMENT_XLAT = {
+    "audit_enforce": "continuously_enforce",
+    "self_service": "no_enforcement",
+    "continuously_enforce": "audit_enforce",
+    "no_enforcement": "self_service",
+    "install_once": "install_once",
+}
+
+# MIME types reported by `file` for disk images and flat installer PKGs
+_IMAGE_MIME_TYPES = ("application/x-apple-diskimage",)
+_PACKAGE_MIME_TYPES = ("application/x-xar",)
+
+# Parsed configs keyed by (path, mtime) so repeat reads skip disk + parse
+_CFG_CACHE = {}
+# Configs larger than this (e.g. an extensive package map) are memory-mapped for parsing
+_MMAP_MIN_BYTES = 1024 * 1024
+
 
 class Configurator:
     """Reads and sets variables based on configured settings"""
@@ -54,20 +79,7 @@ class Configurator:
 
     def _parse_enforcement(self, enforcement):
         """Translates provided enforcement val between config values and API-valid values"""
-        match enforcement.lower():
-            case "audit_enforce":
-                parsed_enforcer = "continuously_enforce"
-            case "self_service":
-                parsed_enforcer = "no_enforcement"
-            case "continuously_enforce":
-                parsed_enforcer = "audit_enforce"
-            case "no_enforcement":
-                parsed_enforcer = "self_service"
-            case "install_once":
-                parsed_enforcer = "install_once"
-            case _:
-                return False
-        return parsed_enforcer
+        return _ENFORCEMENT_XLAT.get(enforcement.lower(), False)
 
     def _read_config(self, kandji_conf):
         """Read in configuration from defined conf path
@@ -78,14 +90,26 @@ class Configurator:
         if not os.path.exists(kandji_conf_path):
             log.fatal(f"kpkg config not found at '{kandji_conf_path}'! Validate its existence and try again")
             sys.exit(1)
+        conf_stat = os.stat(kandji_conf_path)
+        cache_key = (kandji_conf_path, conf_stat.st_mtime_ns)
+        # Returned as-is; callers must copy any nested values they modify
+        if (cached_config := _CFG_CACHE.get(cache_key)) is not None:
+            return cached_config
         try:
-            with open(kandji_conf_path) as f:
-                custom_config = json.loads(f.read())
+            with open(kandji_conf_path, "rb") as f:
+                if conf_stat.st_size > _MMAP_MIN_BYTES:
+                    # Decode straight from the mapped pages, skipping an intermediate bytes copy
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        custom_config = json.loads(str(mm, "utf-8-sig"))
+                else:
+                    # json.loads detects encoding from raw bytes, skipping the text-mode decode layer
+                    custom_config = json.loads(f.read())
         except ValueError as ve:
             log.fatal(
                 f"Config at '{kandji_conf_path}' is not valid JSON!\n{ve} — validate file integrity for '{kandji_conf}' and try again"
             )
             sys.exit(1)
+        _CFG_CACHE[cache_key] = custom_config
         return custom_config
 
     def _populate_package_map(self):
@@ -98,46 +122,38 @@ class Configurator:
         # Initialize vars
         self.package_map = None
         self.app_names = {}
-        if self.kpkg_config.get("use_package_map") is True:
-            self.package_map = self._read_config(self.package_map_file)
-            if self.package_map is False:
-                log.error("Package map is enabled, but config is invalid!")
-                raise Exception
-            self._expand_pkg_get_info(id_query=True)
-
-            for ident, apps in self.package_map.items():
-                # Once matching PKG ID found, assign and exit loop
-                if ident == self.map_id:
-                    log.info(f"Located matching map value '{self.map_id}' from PKG/DMG")
-                    self.app_names = apps
-                    break
-            if not self.app_names:
-                log.warning(f"Package map enabled, but no match found for ID '{self.map_id}'!")
-                log.info("Will use defaults if no args passed")
-        self.map_ss_category = self.app_names.get("ss_category")
-        self.map_test_category = self.app_names.get("test_category")
-
-        # Once assigned, remove from dict
-        # This ensures we're only iterating over app names
-        try:
-            self.app_names.pop("ss_category")
-        except KeyError:
-            pass
-        try:
-            self.app_names.pop("test_category")
-        except KeyError:
-            pass
+        self.map_ss_category, self.map_test_category = None, None
+        # Nothing to populate if map disabled
+        if self.kpkg_config.get("use_package_map") is not True:
+            return
+        self.package_map = self._read_config(self.package_map_file)
+        if self.package_map is False:
+            log.error("Package map is enabled, but config is invalid!")
+            raise Exception
+        self._expand_pkg_get_info(id_query=True)
+
+        # Once matching PKG ID found, assign categories and app names
+        if (apps := self.package_map.get(self.map_id)) is not None:
+            log.info(f"Located matching map value '{self.map_id}' from PKG/DMG")
+            self.map_ss_category = apps.get("ss_category")
+            self.map_test_category = apps.get("test_category")
+            # Leave categories out so we're only iterating over app names
+            self.app_names = {k: v for k, v in apps.items() if k not in ("ss_category", "test_category")}
+        if not self.app_names:
+            log.warning(f"Package map enabled, but no match found for ID '{self.map_id}'!")
+            log.info("Will use defaults if no args passed")
 
     def _set_defaults_enforcements(self):
         """Reads JSON config and sets enforcement based on
         defined value, otherwise defaults to install once"""
         if (default_vals := self.kpkg_config.get("zz_defaults")) is not None:
-            self.default_auto_create = default_vals.get("auto_create_app")
-            self.default_custom_name = default_vals.get("new_app_naming")
-            self.default_dry_run = default_vals.get("dry_run")
-            self.default_dynamic_lookup = default_vals.get("dynamic_lookup")
-            self.default_ss_category = default_vals.get("self_service_category")
-            self.test_default_ss_category = default_vals.get("test_self_service_category")
+            dv_get = default_vals.get
+            self.default_auto_create = dv_get("auto_create_app")
+            self.default_custom_name = dv_get("new_app_naming")
+            self.default_dry_run = dv_get("dry_run")
+            self.default_dynamic_lookup = dv_get("dynamic_lookup")
+            self.default_ss_category = dv_get("self_service_category")
+            self.test_default_ss_category = dv_get("test_self_service_category")
 
         config_enforcement = self.kpkg_config.get("li_enforcement")
         enforcement_type = self._parse_enforcement(config_enforcement.get("type"))
@@ -152,9 +168,9 @@ class Configurator:
             else "install_once"
         )
         # Assign enforcement delays for audits
-        if config_enforcement.get("delays"):
-            self.test_delay = config_enforcement.get("delays").get("test")
-            self.prod_delay = config_enforcement.get("delays").get("prod")
+        if delays := config_enforcement.get("delays"):
+            self.test_delay = delays.get("test")
+            self.prod_delay = delays.get("prod")
 
         self.dry_run = False
         if (self.arg_dry_run or self.default_dry_run) is True:
@@ -176,89 +192,66 @@ class Configurator:
         # If a PKG is found within a DMG, we are overwriting self.derived_name
         # Run through logic gates again to see if re-assignment is necessary
         if not self.app_names or "undefined" in self.app_names.keys():
+            # Name resolution only varies with derived name, so reuse prior result if unchanged
+            cached_derived_name, cached_custom_name = self._custom_name_cache
+            if cached_custom_name is not None and cached_derived_name == self.derived_name:
+                self.custom_app_name = cached_custom_name
             # If not in config, check if custom name(s) passed as args
-            if self.assigned_name is not None:
+            elif self.assigned_name is not None:
                 self.custom_app_name = self.assigned_name
             elif self.default_custom_name is not None:
                 self.custom_app_name = self.default_custom_name.replace("APPNAME", self.derived_name)
             # All else fails, assign as 'derived name (kpkg)'
             else:
                 self.custom_app_name = f"{self.derived_name} (kpkg)"
+            self._custom_name_cache = (self.derived_name, self.custom_app_name)
             self.app_names["undefined"] = self.custom_app_name
 
     def _populate_self_service(self):
         def get_self_service():
             """Queries all Self Service categories from Kandji tenant; assigns GET URL to var for cURL execution
             Runs command and validates output when returning self._validate_response()"""
-            get_url = f"{self.kandji_api_prefix}/self-service/categories"
-            response = requests.get(url=get_url, headers=self.auth_headers)
+            get_url = self.api_self_service_url
+            response = self._session.get(url=get_url, headers=self.auth_headers)
             return self._validate_response(response, "get_selfservice")
 
-        def name_to_id(ss_name, ss_type):
-            """Iterates over self_service list and assigns category ID to var"""
-            # Iter over and find matching id for name
-            ss_default = (
-                self.default_ss_category
-                if ss_type == "prod"
-                else self.test_default_ss_category
-                if ss_type == "test"
-                else None
-            )
-            try:
-                ss_assignment = next(
-                    category.get("id") for category in self.self_service if category.get("name") == ss_name
-                )
-            except StopIteration:
-                log.warning(
-                    f"Provided category '{ss_name}' not found in Self Service!"
-                ) if ss_name is not None else None
-                try:
-                    # Set category id to default (None check performed later)
-                    ss_assignment = (
-                        next(category.get("id") for category in self.self_service if category.get("name") == ss_default)
-                        if ss_default
-                        else None
-                    )
-                except StopIteration:
-                    log.warning(f"Default category '{ss_default}' not found in Self Service!")
-                    ss_assignment = None
-            # Only reassign/override if not already set
-            if ss_type == "prod":
-                if ss_name is not None:
-                    self.ss_category_id = ss_assignment
-                else:
-                    self.ss_category_id = self.ss_category_id if self.ss_category_id is not None else ss_assignment
-            elif ss_type == "test":
-                if ss_name is not None:
-                    self.test_category_id = ss_assignment
-                else:
-                    self.test_category_id = (
-                        self.test_category_id if self.test_category_id is not None else ss_assignment
-                    )
-
-        # Set category IDs to None
-        self.ss_category_id, self.test_category_id = None, None
-
         ############################################
         # Assigns list of dicts to self.self_service
         get_self_service()
+        # Map category names to IDs in one pass; first entry wins on duplicate names
+        ss_by_name = {}
+        for category in self.self_service:
+            if category.get("name"):
+                ss_by_name.setdefault(category["name"], category.get("id"))
 
-        # Create and iter over ad hoc lists with categories/envs
         # If both arg and mapping values defined, override with passed args
-        for cat, env in zip(
-            [self.map_ss_category, self.map_test_category, self.arg_ss_category, self.arg_test_category],
-            ["prod", "test", "prod", "test"],
-        ):
-            name_to_id(cat, env)
+        prod_name = self.arg_ss_category if self.arg_ss_category is not None else self.map_ss_category
+        test_name = self.arg_test_category if self.arg_test_category is not None else self.map_test_category
+        category_ids = []
+        for ss_name, ss_default in ((prod_name, self.default_ss_category), (test_name, self.test_default_ss_category)):
+            ss_assignment = ss_by_name.get(ss_name)
+            if ss_assignment is None:
+                log.warning(
+                    f"Provided category '{ss_name}' not found in Self Service!"
+                ) if ss_name is not None else None
+                # Set category id to default (None check performed later)
+                ss_assignment = ss_by_name.get(ss_default) if ss_default else None
+                if ss_default and ss_assignment is None:
+                    log.warning(f"Default category '{ss_default}' not found in Self Service!")
+            category_ids.append(ss_assignment)
+        self.ss_category_id, self.test_category_id = category_ids
 
     def _set_slack_config(self):
         """Checks if Slack token name is in config
         Looks up webhook and assigns for use in self.slack_notify()"""
 
-        # Check Slack setting and get/assign webhook
-        slack_token_name = (
-            self.kandji_slack_opts.get("webhook_name") if self.kandji_slack_opts.get("enabled") is True else None
-        )
+        opts_get = self.kandji_slack_opts.get
+        # Skip token lookup entirely if Slack not enabled
+        if opts_get("enabled") is not True:
+            self.slack_channel = None
+            return
+        # Get/assign webhook
+        slack_token_name = opts_get("webhook_name")
         self.slack_channel = self._retrieve_token(slack_token_name) if slack_token_name is not None else None
 
     def _set_kandji_config(self):
@@ -270,19 +263,24 @@ class Configurator:
         self.headers = {"Content-Type": "application/json"}
         # Confirm provided Kandji URL is valid
         kandji_test_url = self.kandji_api_url.replace("api", "web-api")
-        response = requests.get(url=kandji_test_url, headers=self.headers)
-        if "tenantNotFound" in response.text:
+        # Reuse pooled session (and its TCP/TLS connections) for all calls to the tenant
+        self._session = http_session()
+        # Marker is returned at the top of the body, so only read the first chunk
+        # Search raw bytes for the ASCII marker, skipping charset detection and decode
+        with self._session.get(url=kandji_test_url, headers=self.headers, stream=True) as response:
+            first_chunk = next(response.iter_content(chunk_size=4096), b"")
+        if b"tenantNotFound" in first_chunk:
             log.fatal(f"Provided Kandji URL '{self.kandji_api_url}' appears invalid! Cannot upload...")
             sys.exit(1)
 
         # Assign tenant URL
         self.tenant_url = self.kandji_api_url.replace(".api.", ".")
         # Assign API domain
-        self.kandji_api_prefix = os.path.join(self.kandji_api_url, "api", "v1")
+        self.kandji_api_prefix = f"{self.kandji_api_url.rstrip('/')}/api/v1"
         # Define API endpoints
-        self.api_custom_apps_url = os.path.join(self.kandji_api_prefix, "library", "custom-apps")
-        self.api_upload_pkg_url = os.path.join(self.api_custom_apps_url, "upload")
-        self.api_self_service_url = os.path.join(self.kandji_api_prefix, "self-service", "categories")
+        self.api_custom_apps_url = f"{self.kandji_api_prefix}/library/custom-apps"
+        self.api_upload_pkg_url = f"{self.api_custom_apps_url}/upload"
+        self.api_self_service_url = f"{self.kandji_api_prefix}/self-service/categories"
 
         # Grab auth token for Kandji API interactions
         kandji_token = self._retrieve_token(self.kandji_token_name)
@@ -308,56 +306,75 @@ class Configurator:
         If found, overrides app name to use PKG value vs. DMG"""
         self.pkg_path = self.pkg_path or self.arg_pkg_path
         self.pkg_name = os.path.basename(self.pkg_path)
-        # Subproc call to determine media type and validity
-        if self._run_command(f"hdiutil imageinfo -format '{self.pkg_path}'", nostderr=True) is not False:
-            self.install_type = "image"
-        elif self._run_command(f"installer -pkginfo -pkg '{self.pkg_path}'", nostderr=True) is not False:
-            self.install_type = "package"
-        else:
-            unsupported_type = self._run_command(f"file --mime-type -b {self.pkg_path}")
-            log.error(f"File '{self.pkg_name}' is unsupported type '{unsupported_type}'")
+
+        def unsupported_media(media_type):
+            """Reports unsupported installer media and raises to skip"""
+            log.error(f"File '{self.pkg_name}' is unsupported type '{media_type}'")
             log.error(f"Confirm '{self.pkg_path}' is valid package/disk image")
             log.error(f"Skipping '{self.pkg_name}'...")
             raise OSError
+
+        # Determine media type from MIME + extension, falling back to hdiutil
+        # Metadata tools below then only run once for the detected type
+        mime_type = self._run_command(["file", "--mime-type", "-b", self.pkg_path])
+        media_suffix = os.path.splitext(self.pkg_name)[1].lower()
+        if mime_type in _IMAGE_MIME_TYPES:
+            self.install_type = "image"
+        elif mime_type in _PACKAGE_MIME_TYPES or (
+            media_suffix in (".pkg", ".mpkg") and mime_type in ("application/octet-stream", "inode/directory")
+        ):
+            self.install_type = "package"
+        # Compressed/sparse/CD/ISO images report generic MIME types, so validate any other media with hdiutil
+        elif self._run_command(["hdiutil", "imageinfo", self.pkg_path], nostderr=True) is not False:
+            self.install_type = "image"
+        else:
+            unsupported_media(mime_type)
         if self.install_type == "image":
-            shell_cmd = f"diskutil image info -plist '{self.pkg_path}'"
-            diskutil_out = self._run_command(shell_cmd, nostderr=True)
+            shell_cmd = ["diskutil", "image", "info", "-plist", self.pkg_path]
+            diskutil_out = self._run_command(shell_cmd, nostderr=True, binary=True)
             if diskutil_out is False:
                 log.warning("Could not retrieve diskutil info for provided DMG")
                 log.warning("Pending EULA may be blocking mount or invalid DMG")
                 self.install_name = None
             else:
-                diskutil_plist_out = plistlib.loads(diskutil_out.encode())
+                diskutil_plist_out = plistlib.loads(diskutil_out, fmt=plistlib.FMT_XML)
+                # Take first named volume, falling back to PKG name if none found
                 self.install_name = next(
-                    disk.get("volume-name")
-                    for disk in diskutil_plist_out.get("Partitions")
-                    if "N/A" not in disk.get("volume-name")
+                    (
+                        volume_name
+                        for disk in diskutil_plist_out.get("Partitions", ())
+                        if (volume_name := disk.get("volume-name")) and "N/A" not in volume_name
+                    ),
+                    None,
                 )
         elif self.install_type == "package":
-            # Subproc call to get PKG name
-            shell_cmd = f"installer -pkginfo -pkg '{self.pkg_path}'"
-            pkginfo_out = self._run_command(shell_cmd)
+            # Subproc call to get PKG name; also validates PKG is readable by installer
+            shell_cmd = ["installer", "-pkginfo", "-pkg", self.pkg_path]
+            pkginfo_out = self._run_command(shell_cmd, nostderr=True)
+            if pkginfo_out is False:
+                unsupported_media(mime_type)
             try:
                 pkginfo_out = pkginfo_out.splitlines()[0]
-            except (IndexError, AttributeError):
+            except IndexError:
                 pass
-            self.install_name = pkginfo_out if pkginfo_out is not False else None
-        # non-capture group matches on optional 64 char hex string
-        # capture matches one or more word and/or whitespace chars (non-greedy)
-        # non-capture positive lookahead assertion to indicate match will be found before version or dashes
-        name_only_pattern = re.compile(r"(?:[a-f0-9]{64}--)?([\w\s]+?)(?=\s+\d+\.\d+|[.-])")
+            self.install_name = pkginfo_out
         if self.install_name:
-            log.debug(f"regex searching {name_only_pattern} against {self.install_name}\nOutput is below:")
             # If PKG/DMG name found, strip out version and other metadata
-            log.debug(re.search(name_only_pattern, self.install_name))
+            name_match = _NAME_ONLY_RE.search(self.install_name)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f"regex searching {_NAME_ONLY_RE} against {self.install_name}\nOutput is below:")
+                log.debug(name_match)
             try:
-                self.install_name = re.search(name_only_pattern, self.install_name).group(1)
+                self.install_name = name_match.group(1)
             except AttributeError as err:
                 log.debug(f"Installer name {self.install_name} couldn't be filtered further; leaving unchanged\n{err}")
         # If no name returned from above, run PKG basename thru re filter to approximate a usable name
-        self.pkg_path_name = (
-            None if self.install_name else re.search(name_only_pattern, os.path.basename(self.pkg_path)).group(1)
-        )
+        if self.install_name:
+            self.pkg_path_name = None
+        else:
+            name_match = _NAME_ONLY_RE.search(self.pkg_name)
+            # If filter fails, fall back to basename without extension
+            self.pkg_path_name = name_match.group(1) if name_match else os.path.splitext(self.pkg_name)[0]
         if lookup_again is True:
             self._populate_package_map()
             self._set_defaults_enforcements()
@@ -375,6 +392,11 @@ class Configurator:
         self.test_app, self.prod_app = False, False
         # Temp dir/path for PKG/DMG expansion to be overwritten later
         self.temp_dir, self.tmp_pkg_path, self.tmp_dmg_mount = None, None, None
+        # Per-run caches; token cache is set before Slack/Kandji token lookups run concurrently
+        self._token_cache = {}
+        self._custom_name_cache = (None, None)
+        self._audit_script_cache = None
+        self._local_shasum = (None, None)
         # Populate config
         self.kpkg_config = self._read_config(self.config_file)
         if self.kpkg_config is False:
@@ -383,7 +405,8 @@ class Configurator:
             kandji_conf = self.kpkg_config["kandji"]
             self.kandji_api_url = kandji_conf["api_url"]
             self.kandji_token_name = kandji_conf["token_name"]
-            self.token_keystores = self.kpkg_config["token_keystore"]
+            # Copied, as config dict is shared via cache and may be overwritten below
+            self.token_keystores = dict(self.kpkg_config["token_keystore"])
             # Overwrite Kandji API URL from ENV or keep as set in config
             self.kandji_api_url = os.environ.get("KANDJI_API_URL", self.kandji_api_url)
             # Overwrite keystore conf from ENV if set
@@ -404,6 +427,10 @@ class Configurator:
         self._populate_package_map()
         self._set_defaults_enforcements()
         self._set_custom_name()
-        self._set_slack_config()
-        self._set_kandji_config()
+        # Slack token lookup is independent of Kandji token lookup + URL validation, so overlap them
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            slack_config = executor.submit(self._set_slack_config)
+            self._set_kandji_config()
+            # Slack must be configured before any API response is validated (errors notify Slack)
+            slack_config.result()
         self._populate_self_service()
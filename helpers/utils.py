@@ -38,26 +38,105 @@ import plistlib
 import re
 import shlex
 import shutil
+import stat
 import sys
 import tempfile
 import time
-import xml.etree.ElementTree as ETree
 from datetime import datetime
-from fileinput import FileInput
-from functools import reduce
-from pathlib import Path, PosixPath
+from functools import cache, lru_cache
+from pathlib import Path
 from subprocess import PIPE, STDOUT, run
 from urllib.parse import urlsplit, urlunsplit
 
-import requests
-from pip._vendor.packaging import version as packaging_version
-
 ###########################
 ######### LOGGING #########
 ###########################
 
 log = logging.getLogger(__name__)
 
+# Info.plists under any of these dirs belong to nested bundles/tools, not the core app
+_NONCORE_PLIST_DIRS_RE = re.compile(
+    r"(?:Extensions|Frameworks|Helpers|Library|MacOS|PlugIns|Resources|SharedSupport|opt|bin)/"
+)
+# Minimum similarity for a PKG name to be considered a match for our PKG
+# Setting limit to .85 is the sweet spot to account for variations in versions
+# Still high enough to exclude both version and name changes (reducing false positives)
+_SIMILARITY_RATIO_LIMIT = 0.85
+# Random chars Kandji appends to uploaded PKG names (e.g. name_1a2b3c4d.pkg)
+_PKG_UUID_RE = re.compile(r"_\w{8}(?=.pkg)")
+# Sanitizing a version from a PKG name drops all but digits/dots, then collapses repeated dots
+_VERS_DROP_RE = re.compile(r"[^0-9.]")
+_VERS_DOTS_RE = re.compile(r"[.]{2,}")
+# Local download path as reported by brew fetch
+_BREW_DOWNLOAD_RE = re.compile(r"(?im)downloaded(?: to)?:\s*(.+)$")
+# Audit script variable assignments we customize before upload
+_AUDIT_VARS_RE = re.compile(
+    r"^(APP_NAME|BUNDLE_ID|PKG_ID|MINIMUM_ENFORCED_VERSION|CREATION_TIMESTAMP|DAYS_UNTIL_ENFORCEMENT)=.*$", re.M
+)
+
+
+@cache
+def _resolve_bin(bin_name):
+    """Returns absolute path for a command name from PATH (resolved once per process)
+    Falls back to the provided name if not found, letting subprocess raise as usual"""
+    if os.path.isabs(bin_name):
+        return bin_name
+    return shutil.which(bin_name) or bin_name
+
+
+@cache
+def http_session():
+    """Returns a process-wide requests.Session, pooling connections to
+    Kandji/S3/Slack and retrying idempotent requests on throttling/server errors"""
+    # Deferred imports; only needed once HTTP is in use
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util import Retry
+
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+    session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retries))
+    return session
+
+
+@lru_cache(maxsize=16)
+def _target_matcher(target):
+    """Returns SequenceMatcher with target as seq2
+    difflib indexes seq2 on set, so reusing one matcher per target
+    and only swapping seq1 avoids reindexing target for each PKG name"""
+    return difflib.SequenceMatcher(None, "", target)
+
+
+@lru_cache(maxsize=4096)
+def _sim_ratio(cleaned_pkg, target):
+    """Returns SequenceMatcher similarity ratio between two PKG names
+    Cached, as the same names are compared across lookups in a run
+    Names whose ratio upper bound falls below the match limit score 0.0"""
+    # Re-uploads of the same PKG are common; identical names are a perfect match
+    if cleaned_pkg == target:
+        return 1.0
+    matcher = _target_matcher(target)
+    matcher.set_seq1(cleaned_pkg)
+    # Cheap upper bounds (length, then char counts) rule out most names before full matching
+    if matcher.real_quick_ratio() < _SIMILARITY_RATIO_LIMIT or matcher.quick_ratio() < _SIMILARITY_RATIO_LIMIT:
+        return 0.0
+    return matcher.ratio()
+
+
+def _sanitize_version(pkg_name):
+    """Returns version str sanitized from a PKG name (UUID removed) for semantic parsing"""
+    vers = _VERS_DROP_RE.sub("", pkg_name.replace(" ", "."))
+    return _VERS_DOTS_RE.sub(".", vers).strip(".")
+
+
+@lru_cache(maxsize=4096)
+def _parse_version(vers_str):
+    """Returns parsed Version for a sanitized version str
+    Cached, as the same versions recur across PKG names and lookups"""
+    from pip._vendor.packaging import version as packaging_version
+
+    return packaging_version.parse(vers_str)
+
 
 def source_from_brew(brew_name):
     """Fetches the download for a Homebrew package and returns local path"""
@@ -73,18 +152,20 @@ def source_from_brew(brew_name):
         log.error(f"Failed to fetch {brew_name} — skipping...")
         log.error(f"Run 'brew search --cask {brew_name}' to validate cask name")
         return None
-    download_path = next(out for out in brew_out.splitlines() if "downloaded" in out.lower()).split(": ")[-1]
+    # Matches either "Downloaded to: <path>" or "Already downloaded: <path>"
+    if (download_match := _BREW_DOWNLOAD_RE.search(brew_out)) is None:
+        log.error(f"Unable to locate download path for {brew_name} from brew output — skipping...")
+        return None
+    download_path = download_match.group(1).strip()
     log.info(f"Downloaded '{brew_name}' to '{download_path}'")
     return download_path
 
 
 def sha256_file(file_path):
     """Returns a SHA256 hash for a provided file"""
-    sha256_hash = hashlib.sha256()
+    # file_digest reads into a reusable buffer and hashes with the GIL released
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(chunk)
-    return sha256_hash.hexdigest()
+        return hashlib.file_digest(f, "sha256").hexdigest()
 
 
 class Utilities:
@@ -94,20 +175,37 @@ class Utilities:
     ######### PRIVATE FUNCTIONS #########
     #####################################
 
-    def _run_command(self, shell_exec, nostderr=False):
-        """Runs a shell command and returns the response"""
+    def _run_command(self, shell_exec, nostderr=False, binary=False):
+        """Runs a shell command and returns the response
+        Accepts either a command str (split with shlex) or an argv list, passed through as-is
+        If binary is True, returns raw stdout bytes (stderr kept separate) for direct parsing"""
+        if isinstance(shell_exec, str):
+            cmd_args = shlex.split(shell_exec)
+        else:
+            cmd_args = shell_exec
+            shell_exec = shlex.join(cmd_args)
         log.debug(f"Running shell command: '{shell_exec}'")
-        raw_out = run(shlex.split(shell_exec), stdout=PIPE, stderr=STDOUT, shell=False, check=False)
+        # Absolute exec path + close_fds=False lets subprocess use posix_spawn vs. fork/exec
+        # Safe to keep FDs open since Python creates them non-inheritable by default
+        cmd_args = [_resolve_bin(cmd_args[0]), *cmd_args[1:]]
+        raw_out = run(
+            cmd_args, stdout=PIPE, stderr=PIPE if binary else STDOUT, shell=False, check=False, close_fds=False
+        )
         exit_code = raw_out.returncode
-        decoded_out = raw_out.stdout.decode().strip()
+        if binary is True and exit_code == 0:
+            return raw_out.stdout
+        decoded_out = (raw_out.stderr if binary is True else raw_out.stdout).decode(errors="replace").strip()
         if exit_code > 0:
             if nostderr is False:
                 log.error(f"'{shell_exec}' failed with exit code {exit_code} and output '{decoded_out}'")
             return False
         return decoded_out
 
-    def _ensure_https(self, url):
-        """Parses provided URL, formats, and returns to ensure proper scheme for cURL"""
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _ensure_https(url):
+        """Parses provided URL, formats, and returns to ensure proper scheme for cURL
+        Cached, as the same tenant/Slack URLs are formatted repeatedly in a run"""
         parsed_url = urlsplit(url)
         if not parsed_url.scheme or parsed_url.scheme == "http":
             netloc = parsed_url.netloc if parsed_url.netloc else parsed_url.path
@@ -120,6 +218,56 @@ class Utilities:
     # Request Funcs
     ######################
 
+    def _on_get_response(self, response, action):
+        """Assigns list of custom apps to var, indexed by name for quick lookup"""
+        self.custom_apps = response.json().get("results")
+        self._apps_by_name = {}
+        for app in self.custom_apps:
+            self._apps_by_name.setdefault(app.get("name"), []).append(app)
+
+    def _on_get_selfservice_response(self, response, action):
+        """Populates categories from Self Service"""
+        self.self_service = response.json()
+
+    def _on_presign_response(self, response, action):
+        """Assigns S3 response for upload URL"""
+        self.s3_generated_req = response.json()
+
+    def _on_upload_response(self, response, action):
+        """Reports upload success"""
+        self.pkg_uploaded = True
+        log.info(f"Successfully uploaded '{self.pkg_name}'!")
+        # Initial sleep allowing S3 to process upload
+        time.sleep(5)
+
+    def _on_create_update_response(self, response, action):
+        """Reports success, posting Custom App details to Slack"""
+        # Parse response body once for all fields
+        custom_app_body = response.json()
+        custom_app_id = custom_app_body.get("id")
+        custom_name = custom_app_body.get("name")
+        custom_app_enforcement = custom_app_body.get("install_enforcement")
+        config_named_enforcement = self._parse_enforcement(custom_app_enforcement)
+        custom_app_url = f"{self.tenant_url.rstrip('/')}/library/custom-apps/{custom_app_id}"
+        log.info(f"SUCCESS: Custom App {action.capitalize()}")
+        log.info(f"Custom App '{custom_name}' available at '{custom_app_url}'")
+        self.slack_notify(
+            "SUCCESS",
+            f"Custom App {action.capitalize()}d",
+            f"*Name*: `{custom_name}`\n*ID*: `{custom_app_id}`\n*Media*: `{self.pkg_name}`\n*Enforcement*: `{config_named_enforcement}`",
+            title_link=custom_app_url,
+        )
+
+    # Action name to handler for healthy responses
+    _RESPONSE_HANDLERS = {
+        "get": _on_get_response,
+        "get_selfservice": _on_get_selfservice_response,
+        "presign": _on_presign_response,
+        "upload": _on_upload_response,
+        "create": _on_create_update_response,
+        "update": _on_create_update_response,
+    }
+
     def _validate_response(self, response, action):
         """Check HTTP response from cURL command; if healthy, take action
         according to the provided method where "get" assigns list of custom apps to var;
@@ -129,51 +277,21 @@ class Utilities:
         Anything else is treated as an error and notifies to Slack with HTTP code and response
         Identified HTTP code 401 adds language to validate permissions for the passed token"""
         http_code = response.status_code
+        action = action.lower()
         if http_code <= 204:
             # Identify specified action and invoke func
-            match action.lower():
-                case "get":
-                    self.custom_apps = response.json().get("results")
-                case "get_selfservice":
-                    self.self_service = response.json()
-                case "presign":
-                    self.s3_generated_req = response.json()
-                case "upload":
-                    self.pkg_uploaded = True
-                    log.info(f"Successfully uploaded '{self.pkg_name}'!")
-                    # Initial sleep allowing S3 to process upload
-                    time.sleep(5)
-                case "create" | "update":
-                    custom_app_id = response.json().get("id")
-                    custom_name = response.json().get("name")
-                    custom_app_enforcement = response.json().get("install_enforcement")
-                    config_named_enforcement = self._parse_enforcement(custom_app_enforcement)
-                    custom_app_url = os.path.join(self.tenant_url, "library", "custom-apps", custom_app_id)
-                    log.info(f"SUCCESS: Custom App {action.capitalize()}")
-                    log.info(f"Custom App '{custom_name}' available at '{custom_app_url}'")
-                    self.slack_notify(
-                        "SUCCESS",
-                        f"Custom App {action.capitalize()}d",
-                        f"*Name*: `{custom_name}`\n*ID*: `{custom_app_id}`\n*Media*: `{self.pkg_name}`\n*Enforcement*: `{config_named_enforcement}`",
-                        title_link=custom_app_url,
-                    )
-                case _:
-                    log.info(
-                        f"Assignment for 'action' must be one of [get|get_selfservice|presign|upload|create|update]; got '{action}'"
-                    )
-                    return False
+            if (handler := self._RESPONSE_HANDLERS.get(action)) is None:
+                log.info(
+                    f"Assignment for 'action' must be one of [get|get_selfservice|presign|upload|create|update]; got '{action}'"
+                )
+                return False
+            handler(self, response, action)
             return True
-        elif http_code == 503 and (action.lower() == "update" or "create"):
+        elif http_code == 503 and action in ("create", "update"):
             log.warning(f"(HTTP {http_code}): {response.json().get('detail')}")
             log.info("Retrying in five seconds...")
             time.sleep(5)
-            return (
-                self.create_custom_app()
-                if action.lower() == "create"
-                else self.update_custom_app()
-                if action.lower() == "update"
-                else None
-            )
+            return self.create_custom_app() if action == "create" else self.update_custom_app()
         else:
             error_body = f"`{self.custom_app_name}`/`{self.pkg_name}` failed to {action}: `{response}`"
             if http_code == 401:
@@ -194,39 +312,48 @@ class Utilities:
 
     def _customize_audit_for_upload(self):
         """Finally a worthy Python replacement for sed
-        Gets current TS and iters over audit script line by line
+        Gets current TS and reads in audit script once
         Searches for our keys and updates them with assigned vals
         Creates a backup file before modification"""
         epoch_now = datetime.now().strftime("%s")
-        with FileInput(files=self.audit_script_path, inplace=True, backup=".bak", encoding="utf-8") as f:
-            for line in f:
-                line = line.rstrip()  # noqa: PLW2901
-                if "APP_NAME=" in line and hasattr(self, "app_name"):
-                    line = f'APP_NAME="{self.app_name}"'  # noqa: PLW2901
-                elif "BUNDLE_ID=" in line and hasattr(self, "bundle_id"):
-                    line = f'BUNDLE_ID="{self.bundle_id}"'  # noqa: PLW2901
-                elif "PKG_ID=" in line and hasattr(self, "pkg_id"):
-                    line = f'PKG_ID="{self.pkg_id}"'  # noqa: PLW2901
-                elif "MINIMUM_ENFORCED_VERSION=" in line and hasattr(self, "app_vers"):
-                    line = f'MINIMUM_ENFORCED_VERSION="{self.app_vers}"'  # noqa: PLW2901
-                elif "CREATION_TIMESTAMP=" in line:
-                    line = f'CREATION_TIMESTAMP="{epoch_now}"'  # noqa: PLW2901
-                elif "DAYS_UNTIL_ENFORCEMENT=" in line:
-                    line = (  # noqa: PLW2901
-                        f"DAYS_UNTIL_ENFORCEMENT={self.test_delay}"
-                        if self.test_app is True
-                        else f"DAYS_UNTIL_ENFORCEMENT={self.prod_delay}"
-                        if self.prod_app is True
-                        else f"DAYS_UNTIL_ENFORCEMENT={self.prod_delay}"
-                        if self.prod_delay
-                        else line
-                    )
-                # Print here writes to file vs. stdout
-                print(line)
+        # Map of replacement values, only including keys we have values for
+        audit_vals = {"CREATION_TIMESTAMP": f'"{epoch_now}"'}
+        for key, attr in (
+            ("APP_NAME", "app_name"),
+            ("BUNDLE_ID", "bundle_id"),
+            ("PKG_ID", "pkg_id"),
+            ("MINIMUM_ENFORCED_VERSION", "app_vers"),
+        ):
+            if hasattr(self, attr):
+                audit_vals[key] = f'"{getattr(self, attr)}"'
+        if self.test_app is True:
+            audit_vals["DAYS_UNTIL_ENFORCEMENT"] = self.test_delay
+        elif self.prod_app is True or self.prod_delay:
+            audit_vals["DAYS_UNTIL_ENFORCEMENT"] = self.prod_delay
+
+        def _replace_val(match):
+            key = match.group(1)
+            return f"{key}={audit_vals[key]}" if key in audit_vals else match.group(0)
+
+        with open(self.audit_script_path, encoding="utf-8") as f:
+            audit_script = f.read()
+        shutil.copy2(self.audit_script_path, self.audit_script_path + ".bak")
+        # Keep customized contents for upload, saving a reread
+        self._audit_script_cache = _AUDIT_VARS_RE.sub(_replace_val, audit_script)
+        with open(self.audit_script_path, "w", encoding="utf-8") as f:
+            f.write(self._audit_script_cache)
+
+    def _get_audit_script(self):
+        """Returns contents of audit script, reading from disk only if not already cached"""
+        if self._audit_script_cache is None:
+            with open(self.audit_script_path, encoding="utf-8") as f:
+                self._audit_script_cache = f.read()
+        return self._audit_script_cache
 
     def _restore_audit(self):
         """Overwrite customized audit script with clean backup"""
         shutil.move(self.audit_script_path + ".bak", self.audit_script_path)
+        self._audit_script_cache = None
 
     ######################
     # Token Lookup Funcs
@@ -235,10 +362,9 @@ class Utilities:
     def _env_token_get(self, item_name):
         """Searches ENV for str `item_name`"""
         token = os.environ.get(item_name, None)
-        # Also search for val from uppercase ENV name
-        upper_token = os.environ.get(item_name.upper(), None)
+        # If not found, also search for val from uppercase ENV name
         if token is None:
-            token = upper_token if upper_token is not None else None
+            token = os.environ.get(item_name.upper(), None)
         return token
 
     def _keychain_token_get(self, item_name):
@@ -250,10 +376,14 @@ class Utilities:
     def _retrieve_token(self, item_name):
         """Searches for by name and returns token for keystores toggled for use
         If multiple keystores are enabled, first searches ENV for token, then if not found, keychain"""
-        token_val = None
+        # Tokens are stable for the life of a run, so only look each up once
+        if item_name in self._token_cache:
+            return self._token_cache[item_name]
         token_val = self._env_token_get(item_name) if self.token_keystores.get("environment") is True else None
         if not token_val:
             token_val = self._keychain_token_get(item_name) if self.token_keystores.get("keychain") is True else None
+        if token_val:
+            self._token_cache[item_name] = token_val
         return token_val
 
     ######################
@@ -266,40 +396,82 @@ class Utilities:
         and proceeds with PackageInfo lookup to enforce install/version from PKG metadata; ends run with temp dir delete
         """
 
-        def _get_dir_size(path="."):
-            """Subfunc to iterate over a dir and return sum total bytesize
-            Defaults to local directory with "." if no arg passed"""
-            total = 0
-            with os.scandir(path) as directory:
-                for entry in directory:
-                    # Ignore symlinks that could lead to inf recursion
-                    if entry.is_file(follow_symlinks=False):
-                        total += entry.stat(follow_symlinks=False).st_size
-                    elif entry.is_dir(follow_symlinks=False):
-                        total += _get_dir_size(entry.path)
-            return total
-
-        def _get_largest_entry(file_list):
-            """Locates largest directory housing file from a list of files"""
-
-            # Create tmp dict
+        # Per-root caches of metadata file paths and dir sizes, so each tree is only walked once
+        walked_metadata = {}
+        walked_dir_sizes = {}
+
+        def _find_files_named(root, filename):
+            """Subfunc to walk a dir tree once, collecting metadata files (Info.plist/PackageInfo/Distribution)
+            Uses only dir entry types (no per-file stat); returns list of paths within root for filename"""
+            root = str(Path(root))
+            if root not in walked_metadata:
+                found_files = {"Info.plist": [], "PackageInfo": [], "Distribution": []}
+                for dirpath, _, filenames in os.walk(root):
+                    for name in filenames:
+                        if name in found_files:
+                            found_files[name].append(os.path.join(dirpath, name))
+                walked_metadata[root] = found_files
+            return walked_metadata[root][filename]
+
+        def _get_dir_sizes(root):
+            """Subfunc to walk a dir tree once (bottom-up) and return a dict
+            mapping each dir path within to its sum total bytesize
+            Only called when choosing between multiple candidates"""
+            root = str(Path(root))
+            if root in walked_dir_sizes:
+                return walked_dir_sizes[root]
             dir_sizes = {}
-            # Iter and assign plist as key and parent dir size as val
-            for file in file_list:
-                dir_sizes[file] = _get_dir_size(os.path.dirname(file))
-            # Get file associated with largest size
-            likely_file = max(dir_sizes, key=dir_sizes.get)
+            # Symlinked dirs are listed but not walked, so they add nothing (avoids inf recursion)
+            for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+                total = sum(dir_sizes.get(os.path.join(dirpath, dirname), 0) for dirname in dirnames)
+                for filename in filenames:
+                    file_stat = os.stat(os.path.join(dirpath, filename), follow_symlinks=False)
+                    # Ignore symlinks, only counting regular files
+                    if stat.S_ISREG(file_stat.st_mode):
+                        total += file_stat.st_size
+                dir_sizes[dirpath] = total
+            walked_dir_sizes[root] = dir_sizes
+            return dir_sizes
+
+        def _get_largest_entry(file_list, root):
+            """Locates largest directory housing file from a list of files within root"""
+            dir_sizes = _get_dir_sizes(root)
+            # Get file associated with largest parent dir size
+            likely_file = max(file_list, key=lambda file: dir_sizes.get(os.path.dirname(file), 0))
             return likely_file
 
-        def _pkg_expand(src, dst):
+        def _pkg_expand(src, dst, full=True):
             """Subprocess runs pkgutil --expand-full
-            on source src, expanding to destination dst"""
+            on source src, expanding to destination dst
+            If full is False, runs pkgutil --expand instead, extracting
+            PKG metadata but leaving component payloads compressed"""
             # Shell out to do PKG expansion and validate success
-            shell_cmd = f"pkgutil --expand-full '{src}' '{dst}'"
+            shell_cmd = ["pkgutil", "--expand-full" if full is True else "--expand", src, dst]
             if self._run_command(shell_cmd) is not False:
                 return True
             return False
 
+        def _pkg_extract_metadata(src, dst):
+            """Extracts only Distribution/PackageInfo files from flat PKG src
+            into destination dst via xar, skipping component payloads entirely
+            Bundle-style PKGs (dirs) fall back to pkgutil --expand"""
+            if not os.path.isfile(src):
+                return _pkg_expand(src, dst, full=False)
+            pkg_members = self._run_command(["xar", "-tf", src])
+            if pkg_members is False:
+                return False
+            metadata_members = [
+                member
+                for member in pkg_members.splitlines()
+                if member in ("Distribution", "PackageInfo") or member.endswith("/PackageInfo")
+            ]
+            os.makedirs(dst, exist_ok=True)
+            if not metadata_members:
+                return True
+            if self._run_command(["xar", "-xf", src, "-C", dst, *metadata_members]) is not False:
+                return True
+            return False
+
         def _dmg_attach(src, dst):
             """Subprocess runs hdiutil attach
             on source src, mounting at destination dst"""
@@ -307,10 +479,22 @@ class Utilities:
             shell_cmd = f"hdiutil attach '{src}' -mountpoint '{dst}' -nobrowse -noverify -noautoopen"
             if self._run_command(shell_cmd) is not False:
                 return True
-            # Run with shell=True to allow pipe
-            shell_cmd = f"hdiutil info | grep '{src}' -A20 | grep -m 1 '/dev/disk' | awk '{{print $1}}'"
-            raw_out = run(shell_cmd, stdout=PIPE, stderr=STDOUT, shell=True, check=False)
-            mount_point = raw_out.stdout.decode().strip()
+            # Locate device entry for any existing attach of src from hdiutil plist output
+            hdiutil_out = self._run_command(["hdiutil", "info", "-plist"], binary=True)
+            if hdiutil_out is False:
+                return False
+            src_realpath = os.path.realpath(src)
+            mount_point = next(
+                (
+                    image["system-entities"][0].get("dev-entry")
+                    for image in plistlib.loads(hdiutil_out).get("images", ())
+                    if image.get("image-path") == src_realpath and image.get("system-entities")
+                ),
+                None,
+            )
+            if mount_point is None:
+                log.error(f"No existing mount point found for DMG at {src}")
+                return False
             log.debug(f"Located existing mount point for DMG at {mount_point}")
             log.debug(f"Attempting unmount of {mount_point}...")
             if _dmg_detach(mount_point) is not False:
@@ -332,55 +516,69 @@ class Utilities:
                 applications_dmg = next(dmg_path.glob("**/Applications")).is_symlink()
             except StopIteration:
                 applications_dmg = False
-                # If no symlink, check for alias
-                # Checking for aliases and where they point is a pain
-                for file in list(dmg_path.glob("*")):
-                    # Run file on each file to check for kind Alias
-                    if "Alias" in self._run_command(f"file -b '{file.absolute().as_posix()}'"):
-                        log.debug(f"Found alias {file.absolute().as_posix()}")
-                        # If found, grep to validate bookmark points to /Applications
-                        if (
-                            self._run_command(f"grep 'book.*mark.*Applications' '{file.absolute().as_posix()}'")
-                            is not False
-                        ):
-                            log.debug(f"Found alias {file} pointing to /Applications")
+                # If no symlink, check top-level files for alias
+                with os.scandir(dmg_path) as entries:
+                    for entry in entries:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        try:
+                            with open(entry.path, "rb") as f:
+                                # Alias files are bookmark data, starting with book/mark magic
+                                header = f.read(16)
+                                if not (header.startswith(b"book") and b"mark" in header):
+                                    continue
+                                bookmark = header + f.read(65536)
+                        except OSError:
+                            continue
+                        log.debug(f"Found alias {entry.path}")
+                        # If found, validate bookmark points to /Applications
+                        if b"Applications" in bookmark:
+                            log.debug(f"Found alias {entry.path} pointing to /Applications")
                             applications_dmg = True
             return applications_dmg
 
+        def _scan_dmg(root):
+            """Walks mounted DMG at root once, collecting .app bundles and .pkg/.mpkg
+            installers; does not descend into either; returns lists of app and PKG paths"""
+            apps, pkgs = [], []
+            stack = [root]
+            while stack:
+                scan_dir = stack.pop()
+                try:
+                    entries = os.scandir(scan_dir)
+                except PermissionError:
+                    # Skip unreadable subdirs (e.g. .Trashes) as glob did
+                    if scan_dir == root:
+                        raise
+                    continue
+                with entries:
+                    for entry in entries:
+                        if entry.name.endswith((".pkg", ".mpkg")):
+                            # Flat PKGs are files, bundle PKGs are dirs
+                            if entry.is_file(follow_symlinks=False) or entry.is_dir(follow_symlinks=False):
+                                pkgs.append(entry.path)
+                        elif entry.is_dir(follow_symlinks=False):
+                            if entry.name.endswith(".app"):
+                                apps.append(entry.path)
+                            else:
+                                stack.append(entry.path)
+            return apps, pkgs
+
         def _plist_find_return(exploded_pkg):
             """Locates all Info.plists within a provided expanded PKG path
             Identifies likely plist for core app (if multiple), populating
             dict with bundle ID, name, and version; returns dict and plist path"""
-            # Make pathlib.Path obj from exploded PKG
-            expanded_pkg_path = Path(exploded_pkg)
-            # Find all Info.plists
-            info_plist_paths = expanded_pkg_path.glob("**/Info.plist")
-            # Rule out Info.plists in nonstandard dirs
+            # Find all Info.plists, ruling out those in nonstandard dirs
             core_app_plists = [
                 plist
-                for plist in info_plist_paths
-                if "Contents/Info.plist" in plist.as_posix()
-                and all(
-                    folder not in plist.as_posix()
-                    for folder in (
-                        "Extensions/",
-                        "Frameworks/",
-                        "Helpers/",
-                        "Library/",
-                        "MacOS/",
-                        "PlugIns/",
-                        "Resources/",
-                        "SharedSupport/",
-                        "opt/",
-                        "bin/",
-                    )
-                )
+                for plist in _find_files_named(exploded_pkg, "Info.plist")
+                if plist.endswith("Contents/Info.plist") and not _NONCORE_PLIST_DIRS_RE.search(plist)
             ]
 
             # If more than one found
             if len(core_app_plists) > 1:
                 log.debug(f"Found multiple ({len(core_app_plists)}) core plists:\n{core_app_plists}")
-                likely_plist = _get_largest_entry(core_app_plists)
+                likely_plist = _get_largest_entry(core_app_plists, exploded_pkg)
             elif len(core_app_plists) == 1:
                 likely_plist = core_app_plists[0]
             else:
@@ -389,10 +587,12 @@ class Utilities:
 
             log.debug(f"Found application plist at path '{likely_plist}'")
 
-            # Quickly iter and assign all plist values we want
+            # Parse plist once, then quickly iter and assign all values we want
             def lookup_from_plist():
+                with open(likely_plist, "rb") as f:
+                    app_plist = plistlib.load(f)
                 return {
-                    k: plistlib.load(open(likely_plist, "rb")).get(k)
+                    k: app_plist.get(k)
                     for k in ("CFBundleIdentifier", "CFBundleShortVersionString", "CFBundleDisplayName", "CFBundleName")
                 }
 
@@ -404,43 +604,53 @@ class Utilities:
             If multiple PackageInfo, attempts query of product vers from Distribution
             If PackageInfo, identifies likely PackageInfo (if multiple), populating values
             for PKG ID and PKG version if set and returning"""
+            import xml.etree.ElementTree as ETree
 
             def _parse_pkg_xml_id_name(xml_file):
                 """Parses PKG ID and version from either Distribution
                 or PackageInfo XML file; returns tuple of ID and version"""
-                # Convert to str if PosixPath
-                if type(xml_file) == PosixPath:
-                    xml_file = xml_file.as_posix()
-                with open(xml_file) as f:
-                    parsed_xml = ETree.parse(f)
-                if "Distribution" in xml_file:
-                    try:
-                        distro_pkg_info = parsed_xml.find("product").attrib
-                    except AttributeError:
-                        return None, None
-                    pkg_id = distro_pkg_info.get("id")
-                    pkg_vers = distro_pkg_info.get("version")
-                elif "PackageInfo" in xml_file:
-                    pkginfo_info = parsed_xml.getroot()
-                    pkg_id = pkginfo_info.get("identifier")
-                    pkg_vers = pkginfo_info.get("version")
-                return pkg_id, pkg_vers
+                # Stream parse, stopping at the first element we need vs. building the full tree
+                with open(xml_file, "rb") as f:
+                    depth = 0
+                    for event, elem in ETree.iterparse(f, events=("start", "end")):
+                        if event == "end":
+                            depth -= 1
+                            continue
+                        depth += 1
+                        if "Distribution" in xml_file:
+                            # Product is a direct child of the root element
+                            if depth == 2 and elem.tag == "product":
+                                return elem.get("id"), elem.get("version")
+                        elif "PackageInfo" in xml_file:
+                            # Values are attributes of the root element
+                            return elem.get("identifier"), elem.get("version")
+                return None, None
 
-            # Make pathlib.Path obj from exploded PKG
-            expanded_pkg_path = Path(exploded_pkg)
             # Find all Distribution/PackageInfo files
-            distro_files = list(expanded_pkg_path.glob("**/Distribution"))
-            # Find and sort PackageInfo(s) by size (largest parent dir first)
-            package_infos = sorted(
-                expanded_pkg_path.glob("**/PackageInfo"), key=lambda x: _get_dir_size(x.parent), reverse=True
-            )
+            distro_files = _find_files_named(exploded_pkg, "Distribution")
+            package_infos = _find_files_named(exploded_pkg, "PackageInfo")
+            # Sort PackageInfo(s) by size (largest parent dir first), only sizing dirs if there's a choice
+            if len(package_infos) > 1:
+                dir_sizes = _get_dir_sizes(exploded_pkg)
+                package_infos = sorted(
+                    package_infos, key=lambda x: dir_sizes.get(os.path.dirname(x), 0), reverse=True
+                )
+
+            # Parse each PackageInfo at most once, as needed, for reuse across lookups below
+            parsed_infos = {}
+
+            def _parsed_info(info):
+                """Returns (cached) tuple of PKG ID and version for PackageInfo info"""
+                if info not in parsed_infos:
+                    parsed_infos[info] = _parse_pkg_xml_id_name(info)
+                return parsed_infos[info]
 
             # If more than one found
             if len(package_infos) > 1:
                 # If map defined, search keys for PKG ID matching lookup
                 if self.package_map:
                     for info in package_infos:
-                        pkg_id, pkg_vers = _parse_pkg_xml_id_name(info)
+                        pkg_id, pkg_vers = _parsed_info(info)
                         if pkg_id in self.package_map.keys() and pkg_vers:
                             log.debug(f"Found matching PackageInfo file from PKG ID mapping '{pkg_id}'")
                             return pkg_id, pkg_vers
@@ -452,7 +662,7 @@ class Utilities:
                     # Assigns first match, so largest matching PKG by size is used
                     if distro_vers is not None:
                         for info in package_infos:
-                            pkg_id, pkg_vers = _parse_pkg_xml_id_name(info)
+                            pkg_id, pkg_vers = _parsed_info(info)
                             if pkg_vers == distro_vers and pkg_id:
                                 log.debug(f"Found PackageInfo file '{pkg_id}' matching Distro vers '{distro_vers}'")
                                 return pkg_id, pkg_vers
@@ -469,7 +679,7 @@ class Utilities:
             log.debug(f"Found PackageInfo file at path '{likely_pkginfo}'")
 
             # Read PackageInfo XML and parse PKG ID/version
-            pkg_id, pkg_vers = _parse_pkg_xml_id_name(likely_pkginfo)
+            pkg_id, pkg_vers = _parsed_info(likely_pkginfo)
             if pkg_id and pkg_vers:
                 return pkg_id, pkg_vers
             else:
@@ -528,10 +738,8 @@ class Utilities:
             mounted_dmg = Path(self.tmp_dmg_mount)
             # If Applications symlink/alias in DMG, likely a drag 'n' drop .app
             applications_dmg = _has_applications_symlink_alias(mounted_dmg)
-            # Locate either .app or .pkg within mounted DMG
-            app_check = list(mounted_dmg.glob("**/*.app"))
-            # Extend search to pkg and mpkg
-            pkg_check = [file for file in mounted_dmg.glob("**/*") if file.suffix in (".pkg", ".mpkg")]
+            # Locate either .app or .pkg/.mpkg within mounted DMG (skip if drag 'n' drop)
+            app_check, pkg_check = ([], []) if applications_dmg is True else _scan_dmg(self.tmp_dmg_mount)
             # Logic check for Applications symlink first
             if applications_dmg is True:
                 app_installer_path = self.tmp_dmg_mount
@@ -539,7 +747,7 @@ class Utilities:
             elif pkg_check:
                 if len(pkg_check) > 1:
                     log.warning("Found multiple PKGs within DMG! Using largest as source...")
-                    chosen_pkg = _get_largest_entry(pkg_check)
+                    chosen_pkg = _get_largest_entry(pkg_check, mounted_dmg)
                 else:
                     chosen_pkg = pkg_check[0]
             # Finally, proceed with .app
@@ -548,24 +756,35 @@ class Utilities:
         if self.install_type == "package" or chosen_pkg is not None:
             chosen_pkg = chosen_pkg or self.pkg_path
             log.debug(f"Selected '{chosen_pkg}' for remaining operations...")
+            # ID query only reads PackageInfo/Distribution, so extract just those
+            # unless a full expansion is already available to reuse
+            if id_query is True and not os.path.exists(self.tmp_pkg_path):
+                expanded_pkg_path = os.path.join(self.temp_dir.name, "pkg_metadata")
+                expand_func = _pkg_extract_metadata
+            else:
+                expanded_pkg_path = self.tmp_pkg_path
+                expand_func = _pkg_expand
             # If PKG expansion fails, raise Exception
-            if not os.path.exists(self.tmp_pkg_path) and _pkg_expand(chosen_pkg, self.tmp_pkg_path) is False:
+            if not os.path.exists(expanded_pkg_path) and expand_func(chosen_pkg, expanded_pkg_path) is False:
                 log.error(f"Unable to parse files as PKG '{chosen_pkg}' failed to expand")
                 raise Exception
             # If install type differs from package, copy PKG to tmp dir and call func again
             if self.install_type != "package":
                 # Copy PKG so we can clean up our temp dir now
-                self.copied_pkg_path = shutil.copy2(chosen_pkg, self.parent_dir)
+                # Only file data is needed, so skip copying metadata (xattrs/ACLs/flags)
+                self.copied_pkg_path = shutil.copyfile(
+                    chosen_pkg, os.path.join(self.parent_dir, os.path.basename(chosen_pkg))
+                )
                 log.debug(f"Copied '{chosen_pkg}' to '{self.copied_pkg_path}'")
                 self.pkg_path = self.copied_pkg_path
                 # Need to reassign values since the PKG, not DMG, is now our source
                 self.get_install_media_metadata(lookup_again=True)
-            app_installer_path = app_installer_path or self.tmp_pkg_path
+            app_installer_path = app_installer_path or expanded_pkg_path
         # Just looking for installer/app ID if id_query is True
         if id_query is True:
             log.debug("Running ID query for installer media")
             if self.install_type == "package":
-                self.map_id, app_vers = _pkg_metadata_find_return(self.tmp_pkg_path)
+                self.map_id, app_vers = _pkg_metadata_find_return(expanded_pkg_path)
             elif self.install_type == "image":
                 plist_values, likely_plist = _plist_find_return(app_installer_path)
                 self.map_id = plist_values["CFBundleIdentifier"]
@@ -620,7 +839,7 @@ class Utilities:
         if more than one match found, collates metadata for matches and reports to Slack with error"""
         # Locate custom app by name
         log.info(f"Searching for '{self.custom_app_name}' from list of custom apps")
-        app_picker = [app for app in self.custom_apps if self.custom_app_name == app.get("name")]
+        app_picker = self._apps_by_name.get(self.custom_app_name, [])
         # If not found, try to find dynamically
         if not app_picker:
             log.warning(f"No existing LI found for provided name '{self.custom_app_name}'!")
@@ -646,32 +865,39 @@ class Utilities:
                 log.info("Will try dynamic lookup from provided PKG...")
                 return self._find_lib_item_dynamic(app_picker)
             # If we get here, means we couldn't decide on a single match
-            # Create Slack body str and notify of duplicates
-            slack_body = ""
+            # Create log/Slack body strs and report duplicates
+            log_body_parts, slack_body_parts = [], []
             # Iter over custom_apps
             for custom_app in app_picker:
                 custom_app_id = custom_app.get("id")
                 # Get PKG name without abs path
-                custom_app_pkg = os.path.basename(custom_app.get("file_key"))
+                custom_app_pkg = custom_app.get("file_key").rpartition("/")[2]
                 custom_app_created = custom_app.get("created_at")
                 custom_app_created_fmt = (
-                    datetime.strptime(custom_app_created, "%Y-%m-%dT%H:%M:%S.%fZ")
-                    .astimezone()
-                    .strftime("%m/%d/%Y @ %I:%M %p")
+                    datetime.fromisoformat(custom_app_created).astimezone().strftime("%m/%d/%Y @ %I:%M %p")
                 )
                 custom_app_updated = custom_app.get("file_updated")
-                custom_app_url = os.path.join(self.tenant_url, "library", "custom-apps", custom_app_id)
+                custom_app_url = f"{self.tenant_url.rstrip('/')}/library/custom-apps/{custom_app_id}"
                 custom_app_url = self._ensure_https(custom_app_url)
-                # Append matching custom app names/MD to Slack body to post
-                slack_body += f"*<{custom_app_url}|Custom App Created _{custom_app_created_fmt}_>*\n*PKG*: `{custom_app_pkg}` (*uploaded* _{custom_app_updated}_)\n\n"
+                # Append matching custom app names/MD to log body
+                log_body_parts.append(
+                    f"{custom_app_url} (created {custom_app_created_fmt})\nPKG: {custom_app_pkg} (uploaded {custom_app_updated})\n"
+                )
+                # Only build Slack body if Slack is configured
+                if self.slack_channel is not None:
+                    slack_body_parts.append(
+                        f"*<{custom_app_url}|Custom App Created _{custom_app_created_fmt}_>*\n*PKG*: `{custom_app_pkg}` (*uploaded* _{custom_app_updated}_)\n\n"
+                    )
             log.error(
-                f"More than one match ({len(app_picker)}) returned for provided LI name! Cannot upload...\n{slack_body}"
-            )
-            self.slack_notify(
-                "ERROR",
-                f"Found Duplicates of Custom App {self.custom_app_name}",
-                f"{slack_body}",
+                f"More than one match ({len(app_picker)}) returned for provided LI name! Cannot upload...\n"
+                + "\n".join(log_body_parts)
             )
+            if self.slack_channel is not None:
+                self.slack_notify(
+                    "ERROR",
+                    f"Found Duplicates of Custom App {self.custom_app_name}",
+                    "".join(slack_body_parts),
+                )
             # Return None to bypass remaining steps
             return None
         try:
@@ -690,91 +916,84 @@ class Utilities:
         ####################
         # Define a function to parse the datetime strings
         def parse_dt(dt_str):
-            """Parses datetime strings from Kandji API into datetime objects"""
-            try:
-                return datetime.strptime(dt_str, "%Y-%m-%dT%H:%M:%S.%fZ").astimezone()
-            except ValueError:
-                return datetime.strptime(dt_str, "%Y-%m-%dT%H:%M:%SZ").astimezone()
-
-        # Get PKG names (no path) if .pkg is suffix
-        all_pkg_names = [
-            os.path.basename(app.get("file_key")) for app in self.custom_apps if app.get("file_key").endswith(".pkg")
+            """Parses datetime strings from Kandji API into datetime objects
+            ISO 8601 parsing handles both with and without fractional seconds"""
+            return datetime.fromisoformat(dt_str).astimezone()
+
+        # Index custom apps by PKG name (no path) if .pkg is suffix
+        # Also record each PKG name with the _ + random UUID chars prepended to .pkg removed
+        pkg_index = {}
+        pkg_records = []
+        for app in self.custom_apps:
+            if (file_key := app.get("file_key")).endswith(".pkg"):
+                pkg = file_key.rpartition("/")[2]
+                if pkg not in pkg_index:
+                    pkg_records.append((pkg, _PKG_UUID_RE.sub("", pkg)))
+                pkg_index.setdefault(pkg, []).append(app)
+        # Identical PKG name (e.g. re-upload of same PKG) is our best match, if unambiguous
+        exact_apps = [
+            app
+            for pkg, cleaned in pkg_records
+            if cleaned == self.pkg_name
+            for app in pkg_index[pkg]
+            if not possible_apps or app in possible_apps
         ]
-        # Create dict to hold PKG names and their similarity scores
-        similarity_scores = {}
-
-        for pkg in all_pkg_names:
-            # re.sub to remove the _ + random UUID chars prepended to .pkg
-            similarity_scores[pkg] = difflib.SequenceMatcher(
-                None, re.sub(r"_\w{8}(?=.pkg)", "", pkg), self.pkg_name
-            ).ratio()
-
-        # Sort dict by similarity scores
-        sorted_similar_pkgs = dict(sorted(similarity_scores.items(), key=lambda k: k[1], reverse=True))
-
-        # Gaudy gauntlet of regex formatting to sanitize the version
-        re_replacements = {r"_\w{8}(?=.pkg)": "", r"[ ]": ".", "[^0-9\\.]": "", r"[.]{2,}": ".", r"^\.|\.$": ""}
-        # Setting limit to .85 is the sweet spot to account for variations in versions
-        # Still high enough to exclude both version and name changes (reducing false positives)
-        ratio_limit = 0.85
-        # Grab all PKG names that are above our sim threshold
-        possible_pkgs = [pkg for pkg in sorted_similar_pkgs.keys() if sorted_similar_pkgs.get(pkg) >= ratio_limit]
+        if len(exact_apps) == 1:
+            custom_app = exact_apps[0]
+            log.info(f"Found exact match '{custom_app.get('name')}' with ID '{custom_app.get('id')}' for provided PKG")
+            log.info("Proceeding to update...")
+            return custom_app
+        # Grab all PKG names (mapped to cleaned names) that are above our sim threshold
+        # No need to rank by similarity, as matches are ordered by version below
+        possible_pkgs = {
+            pkg: cleaned
+            for pkg, cleaned in pkg_records
+            if _sim_ratio(cleaned, self.pkg_name) >= _SIMILARITY_RATIO_LIMIT
+        }
 
         # If possible_apps defined, we were given a specific name to validate against
         provided_app_name = None
         if possible_apps:
-            matching_pkgs = []
+            matching_pkgs = {}
             for possible in possible_apps:
-                # Any matches are added to matching_pkgs list
-                matching_pkgs.extend(pkg for pkg in possible_pkgs if pkg in possible.get("file_key"))
+                # Any matches are added to matching_pkgs
+                matching_pkgs.update(
+                    (pkg, cleaned) for pkg, cleaned in possible_pkgs.items() if pkg in possible.get("file_key")
+                )
             # One or more matches, reassign var
             if matching_pkgs:
                 possible_pkgs = matching_pkgs
             # Assign provided_app_name as unique name from possible_apps (should only be one)
-            provided_app_name = "".join({possible.get("name") for possible in possible_apps})
+            possible_names = {possible.get("name") for possible in possible_apps}
+            provided_app_name = next(iter(possible_names)) if len(possible_names) == 1 else None
 
         # Dict to hold PKG names and their sanitized vers strs for semantic parsing
-        pkgs_versions = {
-            maybepkg: reduce(
-                lambda parsed_vers, match_replace: re.sub(*match_replace, parsed_vers),
-                re_replacements.items(),
-                maybepkg,
-            )
-            for maybepkg in possible_pkgs
-        }
-
-        # Sort PKGs according to semantic versioning
-        pkgs_versions_sorted = dict(
-            sorted(pkgs_versions.items(), key=lambda k: packaging_version.parse(k[1]), reverse=True)
-        )
+        # Only sanitized for matches, starting from already cleaned names
+        pkgs_versions = {maybepkg: _sanitize_version(cleaned) for maybepkg, cleaned in possible_pkgs.items()}
 
         try:
             custom_app = None
-            # Iter over it and grab first item with highest vers
-            custom_pkg_name, custom_pkg_vers = next(iter(pkgs_versions_sorted.items()))
+            if not pkgs_versions:
+                raise StopIteration
+            # Grab item with highest vers according to semantic versioning
+            custom_pkg_name, custom_pkg_vers = max(pkgs_versions.items(), key=lambda k: _parse_version(k[1]))
 
             # Get custom PKG name with highest version
-            highest_vers = [
-                pkg for pkg in pkgs_versions_sorted.keys() if custom_pkg_vers in pkgs_versions_sorted.get(pkg)
-            ]
+            highest_vers = [pkg for pkg, vers in pkgs_versions.items() if custom_pkg_vers in vers]
             # Check if more than one vers found matching highest
             if len(highest_vers) > 1:
                 # Create dict to hold PKG names and their mod dates
                 pkg_custom_app_updated = {}
                 for pkg in highest_vers:
-                    try:
-                        # Find the matching app record
-                        app_record = next(app for app in self.custom_apps if pkg in app.get("file_key"))
-                        pkg_uploaded = app_record.get("file_updated")
-                        custom_li_modified = app_record.get("updated_at")
-                        # Append to dict
-                        pkg_custom_app_updated[pkg] = {
-                            "pkg_uploaded": pkg_uploaded,
-                            "custom_li_modified": custom_li_modified,
-                        }
-                    # Not found if searching only names matching user input
-                    except StopIteration:
-                        pass
+                    # Find the matching app record
+                    app_record = pkg_index[pkg][0]
+                    pkg_uploaded = app_record.get("file_updated")
+                    custom_li_modified = app_record.get("updated_at")
+                    # Append to dict
+                    pkg_custom_app_updated[pkg] = {
+                        "pkg_uploaded": pkg_uploaded,
+                        "custom_li_modified": custom_li_modified,
+                    }
                 # Find the oldest app by first pkg_uploaded, and if identical, custom_li_modified
                 oldest_app = min(
                     pkg_custom_app_updated,
@@ -786,7 +1005,7 @@ class Utilities:
                 custom_pkg_name = oldest_app
 
             # Assign this as our best guess PKG
-            matching_entry = [app for app in self.custom_apps if custom_pkg_name in app.get("file_key")]
+            matching_entry = pkg_index.get(custom_pkg_name, [])
             if len(matching_entry) > 1:
                 if provided_app_name is not None:
                     matching_entry = [app for app in matching_entry if provided_app_name in app.get("name")]
@@ -826,7 +1045,7 @@ class Utilities:
         if title_link:
             title_link = self._ensure_https(title_link)
             slack_payload["attachments"][0]["title_link"] = title_link
-        slack_response = requests.post(self.slack_channel, headers=self.headers, data=json.dumps(slack_payload))
+        slack_response = self._session.post(self.slack_channel, headers=self.headers, data=json.dumps(slack_payload))
         if slack_response.status_code <= 204:
             log.info("Successfully posted message to Slack channel")
         else:
@@ -44,7 +44,6 @@ import shutil
 import sys
 from pathlib import Path
 
-import requests
 from helpers.configs import Configurator
 from helpers.utils import Utilities, sha256_file, source_from_brew
 
@@ -210,7 +209,7 @@ class KPKG(Configurator, Utilities):
             """Generates an S3 presigned URL to upload a PKG"""
             post_url = self.api_upload_pkg_url
             form_data = {"name": self.pkg_name}
-            response = requests.post(post_url, headers=self.auth_headers, params=self.params, json=form_data)
+            response = self._session.post(post_url, headers=self.auth_headers, params=self.params, json=form_data)
             return self._validate_response(response, "presign")
 
         if self.pkg_uploaded is True:
@@ -224,13 +223,20 @@ class KPKG(Configurator, Utilities):
         upload_url = self.s3_generated_req.get("post_url")
         s3_data = self.s3_generated_req.get("post_data")
         self.s3_key = self.s3_generated_req.get("file_key")
-        s3_data["file"] = open(self.pkg_path, "rb")
 
         if self.dry_run is True:
             log.info(f"DRY RUN: Would upload PKG '{self.pkg_path} as POST to '{upload_url}'")
             return True
         log.info(f"Beginning file upload of '{self.pkg_name}'...")
-        response = requests.post(upload_url, files=s3_data)
+        # Deferred import; pulls in requests, only needed once uploading
+        from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+        with open(self.pkg_path, "rb") as f:
+            # Stream multipart body from disk vs. buffering PKG in memory; S3 requires file as last field
+            upload_form = MultipartEncoder(fields={**s3_data, "file": (os.path.basename(self.pkg_path), f)})
+            response = self._session.post(
+                upload_url, data=upload_form, headers={"Content-Type": upload_form.content_type}
+            )
         return self._validate_response(response, "upload")
 
     def create_custom_app(self):
@@ -243,9 +249,7 @@ class KPKG(Configurator, Utilities):
             "install_enforcement": self.custom_app_enforcement,
         }
         if self.custom_app_enforcement == "continuously_enforce":
-            with open(self.audit_script_path) as f:
-                audit_script = f.read()
-            create_data["audit_script"] = audit_script
+            create_data["audit_script"] = self._get_audit_script()
         elif self.custom_app_enforcement == "no_enforcement":
             # If no enforcement, set to show in Self Service
             create_data["show_in_self_service"] = True
@@ -266,7 +270,7 @@ class KPKG(Configurator, Utilities):
                 f"DRY RUN: Would create Custom App '{self.custom_app_name}' with POST to '{post_url}' and fields '{create_data}'"
             )
             return True
-        response = requests.post(post_url, headers=self.auth_headers, params=self.params, json=create_data)
+        response = self._session.post(post_url, headers=self.auth_headers, params=self.params, json=create_data)
         return self._validate_response(response, "create")
 
     def update_custom_app(self):
@@ -277,7 +281,7 @@ class KPKG(Configurator, Utilities):
             """Queries all custom apps from Kandji tenant; assigns GET URL to var for cURL execution
             Runs command and validates output when returning self._validate_response()"""
             get_url = self.api_custom_apps_url
-            response = requests.get(get_url, headers=self.auth_headers)
+            response = self._session.get(get_url, headers=self.auth_headers)
             # Assigns self.custom_apps
             return self._validate_response(response, "get")
 
@@ -305,8 +309,11 @@ class KPKG(Configurator, Utilities):
         lib_item_enforcement = lib_item_dict.get("install_enforcement")
         lib_item_shasum = lib_item_dict.get("sha256")
 
-        # Get sha256 of local media
-        local_media_shasum = sha256_file(self.pkg_path)
+        # Get sha256 of local media, only hashing once per PKG across test/prod runs
+        shasum_path, local_media_shasum = self._local_shasum
+        if shasum_path != self.pkg_path:
+            local_media_shasum = sha256_file(self.pkg_path)
+            self._local_shasum = (self.pkg_path, local_media_shasum)
 
         log.info(f"Proceeding to update existing custom app '{lib_item_name}'")
 
@@ -335,28 +342,30 @@ class KPKG(Configurator, Utilities):
                 # Call audit customization here since not invoked earlier
                 self._customize_audit_for_upload()
                 self.custom_app_enforcement = lib_item_enforcement
-            with open(self.audit_script_path) as f:
-                audit_script = f.read()
-                update_data["audit_script"] = audit_script
-        patch_url = os.path.join(self.api_custom_apps_url, lib_item_uuid)
+            update_data["audit_script"] = self._get_audit_script()
+        patch_url = f"{self.api_custom_apps_url}/{lib_item_uuid}"
         if self.dry_run is True:
             log.info(
                 f"DRY RUN: Would update Custom App '{lib_item_name}' with PATCH to '{patch_url}' and fields '{update_data}'"
             )
             return True
-        response = requests.patch(patch_url, headers=self.auth_headers, params=self.params, json=update_data)
+        response = self._session.patch(patch_url, headers=self.auth_headers, params=self.params, json=update_data)
         return self._validate_response(response, "update")
 
     def kandji_customize_create_update(self):
         """Parent function to process any audit script updates and
         either create a net new or update an existing custom app"""
-        self._customize_audit_for_upload() if self.custom_app_enforcement == "continuously_enforce" else True
+        needs_audit = self.custom_app_enforcement == "continuously_enforce"
+        if needs_audit:
+            self._customize_audit_for_upload()
         # If flag override is set, create new app regardless of existing
         if self.arg_create_new is True:
             self.create_custom_app()
         else:
             self.update_custom_app()
-        self._restore_audit() if self.custom_app_enforcement == "continuously_enforce" else True
+        # Update may defer to existing continuous enforcement, customizing the audit script there
+        if needs_audit or self.custom_app_enforcement == "continuously_enforce":
+            self._restore_audit()
 
     def main(self):
         """Main function to execute KPKG"""